@@ -1 +1,14 @@
-# FreePay Backend Package
\ No newline at end of file
+# FreePay Backend Package
+import os
+from dotenv import load_dotenv
+
+# Production deploys inject real env vars; only local runs read freepay-backend/.env
+ENV_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env")
+
+def load_env():
+    """Load freepay-backend/.env for local runs"""
+    if not os.getenv("KUBERNETES_SERVICE_HOST") and os.path.exists(ENV_FILE):
+        load_dotenv(ENV_FILE)
+
+# Runs on first import of any app module, before that module reads its settings
+load_env()
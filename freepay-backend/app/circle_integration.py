@@ -3,15 +3,25 @@ Circle USDC Integration for EazyPay
 Handles stablecoin payments and programmable wallets
 """
 import os
+import time
 import asyncio
 import aiohttp
-from typing import Dict, Any, Optional, List
+import orjson
+from typing import Dict, Any, Optional, List, Tuple
 from dataclasses import dataclass
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
+def new_idempotency_key() -> str:
+    """Generate an idempotency key for Circle write requests
+    
+    Circle validates these as hyphenated UUID v4 strings, so the canonical
+    str() form is required (uuid4().hex or token_hex keys are rejected).
+    """
+    return str(uuid.uuid4())
+
 @dataclass
 class CircleWallet:
     wallet_id: str
@@ -47,6 +57,44 @@ class CircleAPIClient:
             "BASE": "Base",
             "AVAX": "Avalanche"
         }
+        
+        # Shared HTTP session, created lazily so the connection pool is reused
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Short-lived balance cache so checkout retries don't refetch from Circle
+        self._balance_ttl = 5.0
+        self._balance_cache: Dict[str, Tuple[float, Dict[str, float]]] = {}
+        self._balance_locks: Dict[str, asyncio.Lock] = {}
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=200,
+                limit_per_host=30,
+                ttl_dns_cache=300,
+                keepalive_timeout=75
+            )
+            # Bound every call so a hung Circle endpoint can't stall the worker
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                json_serialize=lambda obj: orjson.dumps(obj).decode(),
+                timeout=aiohttp.ClientTimeout(total=10, connect=3, sock_read=8)
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def __aenter__(self) -> "CircleAPIClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
     
     async def create_wallet(
         self, 
@@ -55,48 +103,73 @@ class CircleAPIClient:
     ) -> CircleWallet:
         """Create a programmable wallet for customer"""
         try:
-            async with aiohttp.ClientSession() as session:
-                wallet_data = {
-                    "idempotencyKey": str(uuid.uuid4()),
-                    "description": f"EazyPay wallet for {customer_id}",
-                    "walletSetId": os.getenv("CIRCLE_WALLET_SET_ID"),
-                    "blockchain": blockchain
-                }
-                
-                url = f"{self.base_url}/wallets"
-                async with session.post(url, headers=self.headers, json=wallet_data) as response:
-                    if response.status in [200, 201]:
-                        data = await response.json()
-                        wallet = data.get("data", {})
-                        return CircleWallet(
-                            wallet_id=wallet.get("walletId"),
-                            address=wallet.get("address"),
-                            blockchain=blockchain,
-                            balance=0.0
-                        )
-                    else:
-                        error = await response.text()
-                        logger.error(f"Circle wallet creation failed: {error}")
-                        raise Exception(f"Failed to create wallet: {error}")
-                        
+            session = await self._get_session()
+            wallet_data = {
+                "idempotencyKey": new_idempotency_key(),
+                "description": f"EazyPay wallet for {customer_id}",
+                "walletSetId": os.getenv("CIRCLE_WALLET_SET_ID"),
+                "blockchain": blockchain
+            }
+            
+            url = f"{self.base_url}/wallets"
+            async with session.post(url, json=wallet_data) as response:
+                if response.status in [200, 201]:
+                    data = orjson.loads(await response.read())
+                    wallet = data.get("data", {})
+                    return CircleWallet(
+                        wallet_id=wallet.get("walletId"),
+                        address=wallet.get("address"),
+                        blockchain=blockchain,
+                        balance=0.0
+                    )
+                else:
+                    error = await response.text()
+                    logger.error(f"Circle wallet creation failed: {error}")
+                    raise Exception(f"Failed to create wallet: {error}")
+                    
+        except asyncio.TimeoutError:
+            logger.error("Circle wallet creation timed out")
+            raise
         except Exception as e:
             logger.error(f"Circle integration error: {e}")
             raise
     
+    def _cached_balance(self, wallet_id: str) -> Optional[Dict[str, float]]:
+        """Return cached balances for a wallet if they are still fresh"""
+        cached = self._balance_cache.get(wallet_id)
+        if cached and time.monotonic() - cached[0] < self._balance_ttl:
+            return cached[1]
+        return None
+    
     async def get_wallet_balance(self, wallet_id: str) -> Dict[str, float]:
         """Get USDC balance across all chains"""
-        async with aiohttp.ClientSession() as session:
+        balances = self._cached_balance(wallet_id)
+        if balances is not None:
+            return balances
+        
+        # One fetch per wallet at a time; concurrent callers reuse its result
+        lock = self._balance_locks.setdefault(wallet_id, asyncio.Lock())
+        async with lock:
+            balances = self._cached_balance(wallet_id)
+            if balances is not None:
+                return balances
+            
+            session = await self._get_session()
             url = f"{self.base_url}/wallets/{wallet_id}/balances"
-            async with session.get(url, headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    balances = {}
-                    for balance in data.get("data", []):
-                        if balance.get("currency") == "USD":
-                            chain = balance.get("chain")
-                            amount = float(balance.get("amount", 0))
-                            balances[chain] = amount
-                    return balances
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        data = orjson.loads(await response.read())
+                        balances = {
+                            balance.get("chain"): float(balance.get("amount", 0))
+                            for balance in data.get("data", ())
+                            if balance.get("currency") == "USD"
+                        }
+                        self._balance_cache[wallet_id] = (time.monotonic(), balances)
+                        return balances
+                    return {}
+            except asyncio.TimeoutError:
+                logger.error(f"Circle balance lookup timed out for wallet {wallet_id}")
                 return {}
     
     async def create_transfer(
@@ -108,47 +181,52 @@ class CircleAPIClient:
     ) -> CircleTransfer:
         """Transfer USDC between wallets"""
         try:
-            async with aiohttp.ClientSession() as session:
-                transfer_data = {
-                    "idempotencyKey": str(uuid.uuid4()),
-                    "source": {
-                        "type": "wallet",
-                        "id": source_wallet_id
-                    },
-                    "destination": {
-                        "type": "blockchain",
-                        "address": destination_address,
-                        "chain": blockchain
-                    },
-                    "amount": {
-                        "amount": str(amount),
-                        "currency": "USD"
-                    }
+            session = await self._get_session()
+            transfer_data = {
+                "idempotencyKey": new_idempotency_key(),
+                "source": {
+                    "type": "wallet",
+                    "id": source_wallet_id
+                },
+                "destination": {
+                    "type": "blockchain",
+                    "address": destination_address,
+                    "chain": blockchain
+                },
+                "amount": {
+                    "amount": str(amount),
+                    "currency": "USD"
                 }
-                
-                url = f"{self.base_url}/transfers"
-                async with session.post(url, headers=self.headers, json=transfer_data) as response:
-                    if response.status in [200, 201]:
-                        data = await response.json()
-                        transfer = data.get("data", {})
-                        return CircleTransfer(
-                            transfer_id=transfer.get("id"),
-                            source_wallet=source_wallet_id,
-                            destination_wallet=destination_address,
-                            amount=amount,
-                            status=transfer.get("status"),
-                            blockchain=blockchain
-                        )
-                    else:
-                        error = await response.text()
-                        logger.error(f"Circle transfer failed: {error}")
-                        raise Exception(f"Failed to create transfer: {error}")
-                        
+            }
+            
+            url = f"{self.base_url}/transfers"
+            async with session.post(url, json=transfer_data) as response:
+                if response.status in [200, 201]:
+                    data = orjson.loads(await response.read())
+                    transfer = data.get("data", {})
+                    # The source wallet's balance has changed
+                    self._balance_cache.pop(source_wallet_id, None)
+                    return CircleTransfer(
+                        transfer_id=transfer.get("id"),
+                        source_wallet=source_wallet_id,
+                        destination_wallet=destination_address,
+                        amount=amount,
+                        status=transfer.get("status"),
+                        blockchain=blockchain
+                    )
+                else:
+                    error = await response.text()
+                    logger.error(f"Circle transfer failed: {error}")
+                    raise Exception(f"Failed to create transfer: {error}")
+                    
+        except asyncio.TimeoutError:
+            logger.error("Circle transfer timed out")
+            raise
         except Exception as e:
             logger.error(f"Circle transfer error: {e}")
             raise
     
-    async def get_exchange_rate(self, from_currency: str = "USD", to_currency: str = "EUR") -> float:
+    def get_exchange_rate(self, from_currency: str = "USD", to_currency: str = "EUR") -> float:
         """Get USDC exchange rates"""
         # Circle provides stable 1:1 for USDC to USD
         # This would integrate with their FX API for other currencies
@@ -165,26 +243,30 @@ class CircleAPIClient:
 
 # Smart routing for optimal USDC chain selection
 class USDCSmartRouter:
-    def __init__(self):
-        self.chain_fees = {
-            "ETH": 15.00,      # Ethereum mainnet - high fees
-            "MATIC": 0.01,     # Polygon - very low fees
-            "ARB": 0.10,       # Arbitrum - low fees
-            "OP": 0.10,        # Optimism - low fees
-            "BASE": 0.05,      # Base - low fees
-            "AVAX": 0.50       # Avalanche - medium fees
-        }
-        
-        self.chain_speeds = {
-            "ETH": 180,        # ~3 minutes
-            "MATIC": 3,        # ~3 seconds
-            "ARB": 2,          # ~2 seconds
-            "OP": 2,           # ~2 seconds
-            "BASE": 2,         # ~2 seconds
-            "AVAX": 2          # ~2 seconds
-        }
+    chain_fees = {
+        "ETH": 15.00,      # Ethereum mainnet - high fees
+        "MATIC": 0.01,     # Polygon - very low fees
+        "ARB": 0.10,       # Arbitrum - low fees
+        "OP": 0.10,        # Optimism - low fees
+        "BASE": 0.05,      # Base - low fees
+        "AVAX": 0.50       # Avalanche - medium fees
+    }
     
-    async def select_optimal_chain(
+    chain_speeds = {
+        "ETH": 180,        # ~3 minutes
+        "MATIC": 3,        # ~3 seconds
+        "ARB": 2,          # ~2 seconds
+        "OP": 2,           # ~2 seconds
+        "BASE": 2,         # ~2 seconds
+        "AVAX": 2          # ~2 seconds
+    }
+    
+    # Fee and speed tables are static, so the chains are ranked once per process
+    # (ties keep table order, e.g. ARB before BASE/AVAX on speed)
+    _cost_order = sorted(chain_fees, key=chain_fees.get)
+    _speed_order = sorted(chain_speeds, key=chain_speeds.get)
+    
+    def select_optimal_chain(
         self,
         amount: float,
         available_chains: List[str],
@@ -193,41 +275,46 @@ class USDCSmartRouter:
         """Select the best blockchain for USDC transfer"""
         if not available_chains:
             return "BASE"  # Default to Base
+        if len(available_chains) == 1:
+            return available_chains[0]  # Nothing to rank
         
-        if priority == "cost":
-            # Sort by fees (lowest first)
-            sorted_chains = sorted(
-                available_chains,
-                key=lambda x: self.chain_fees.get(x, 999)
-            )
-        else:
-            # Sort by speed (fastest first)
-            sorted_chains = sorted(
-                available_chains,
-                key=lambda x: self.chain_speeds.get(x, 999)
-            )
+        # Walk the precomputed ranking (lowest fee or fastest first)
+        order = self._cost_order if priority == "cost" else self._speed_order
+        available = frozenset(available_chains)
+        for chain in order:
+            if chain in available:
+                return chain
         
-        return sorted_chains[0]
+        # None of the chains are known to the router
+        return available_chains[0]
 
 # Integration with EazyPay
 async def process_circle_payment(
     amount: float,
     customer_wallet: str,
     merchant_wallet: str,
-    preferred_chain: str = None
+    preferred_chain: str = None,
+    client: Optional[CircleAPIClient] = None
 ) -> Dict[str, Any]:
-    """Process USDC payment through Circle"""
-    try:
+    """Process USDC payment through Circle
+    
+    Pass a long-lived ``client`` to reuse its connection pool; otherwise a
+    temporary client is created and closed for this payment.
+    """
+    owns_client = client is None
+    if owns_client:
         client = CircleAPIClient()
-        router = USDCSmartRouter()
-        
-        # Get available chains for customer
-        balances = await client.get_wallet_balance(customer_wallet)
-        available_chains = [chain for chain, balance in balances.items() if balance >= amount]
-        
-        # Select optimal chain
+    
+    try:
+        # Balances only feed chain selection, so skip the round-trip when
+        # the caller has already picked a chain
         if not preferred_chain:
-            preferred_chain = await router.select_optimal_chain(
+            # Get available chains for customer
+            balances = await client.get_wallet_balance(customer_wallet)
+            available_chains = [chain for chain, balance in balances.items() if balance >= amount]
+            
+            # Select optimal chain
+            preferred_chain = USDCSmartRouter().select_optimal_chain(
                 amount=amount,
                 available_chains=available_chains,
                 priority="cost"
@@ -247,8 +334,8 @@ async def process_circle_payment(
             "transfer_id": transfer.transfer_id,
             "amount": transfer.amount,
             "chain": preferred_chain,
-            "fee": router.chain_fees.get(preferred_chain, 0),
-            "estimated_time": router.chain_speeds.get(preferred_chain, 10),
+            "fee": USDCSmartRouter.chain_fees.get(preferred_chain, 0),
+            "estimated_time": USDCSmartRouter.chain_speeds.get(preferred_chain, 10),
             "status": transfer.status,
             "message": f"USDC transfer initiated on {preferred_chain}"
         }
@@ -260,6 +347,9 @@ async def process_circle_payment(
             "provider": "Circle USDC",
             "error": str(e)
         }
+    finally:
+        if owns_client:
+            await client.close()
 
 # Demo test function
 async def test_circle_integration():
@@ -277,7 +367,7 @@ async def test_circle_integration():
     print(f"Wallet created: {wallet.address} on {wallet.blockchain}")
     
     # Test smart routing
-    optimal_chain = await router.select_optimal_chain(
+    optimal_chain = router.select_optimal_chain(
         amount=25.00,
         available_chains=["ETH", "BASE", "MATIC"],
         priority="cost"
@@ -288,9 +378,12 @@ async def test_circle_integration():
     result = await process_circle_payment(
         amount=15.00,
         customer_wallet="test_customer_wallet",
-        merchant_wallet="test_merchant_wallet"
+        merchant_wallet="test_merchant_wallet",
+        client=client
     )
     print(f"Payment result: {result}")
+    
+    await client.close()
 
 if __name__ == "__main__":
     asyncio.run(test_circle_integration())
\ No newline at end of file
@@ -5,6 +5,7 @@ Handles crypto payment processing via Coinbase
 import os
 import asyncio
 import aiohttp
+import orjson
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
 import hashlib
@@ -32,6 +33,46 @@ class CoinbaseCommerceClient:
             "X-CC-Version": "2018-03-22",
             "Content-Type": "application/json"
         }
+        
+        # Keyed HMAC state is built once; verify_webhook copies it per call.
+        # Without a secret every webhook is rejected.
+        self._hmac_template = (
+            hmac.new(self.webhook_secret.encode(), None, hashlib.sha256)
+            if self.webhook_secret else None
+        )
+        
+        # Shared HTTP session, created lazily so the connection pool is reused
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            # Only one host is ever called, so a small per-host pool is enough
+            # to keep status polls on warm keep-alive connections
+            connector = aiohttp.TCPConnector(
+                limit_per_host=10,
+                ttl_dns_cache=300,
+                keepalive_timeout=75
+            )
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                json_serialize=lambda obj: orjson.dumps(obj).decode(),
+                timeout=aiohttp.ClientTimeout(total=15, connect=3, sock_read=8)
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def __aenter__(self) -> "CoinbaseCommerceClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
     
     async def create_charge(
         self,
@@ -42,50 +83,54 @@ class CoinbaseCommerceClient:
     ) -> CoinbasePayment:
         """Create a payment charge for customer"""
         try:
-            async with aiohttp.ClientSession() as session:
-                charge_data = {
-                    "name": description,
-                    "description": f"Payment from {customer_name or 'Customer'}",
-                    "pricing_type": "fixed_price",
-                    "local_price": {
-                        "amount": str(amount),
-                        "currency": currency
-                    },
-                    "metadata": {
-                        "customer": customer_name,
-                        "payment_method": "EazyPay_NFC",
-                        "integration": "tap_to_pay"
-                    }
+            session = await self._get_session()
+            charge_data = {
+                "name": description,
+                "description": f"Payment from {customer_name or 'Customer'}",
+                "pricing_type": "fixed_price",
+                "local_price": {
+                    "amount": str(amount),
+                    "currency": currency
+                },
+                "metadata": {
+                    "customer": customer_name,
+                    "payment_method": "EazyPay_NFC",
+                    "integration": "tap_to_pay"
                 }
-                
-                url = f"{self.base_url}/charges"
-                async with session.post(url, headers=self.headers, json=charge_data) as response:
-                    if response.status in [200, 201]:
-                        data = await response.json()
-                        charge = data.get("data", {})
-                        return CoinbasePayment(
-                            charge_id=charge.get("id"),
-                            amount=amount,
-                            currency=currency,
-                            status="pending",
-                            payment_url=charge.get("hosted_url")
-                        )
-                    else:
-                        error = await response.text()
-                        logger.error(f"Coinbase charge creation failed: {error}")
-                        raise Exception(f"Failed to create charge: {error}")
-                        
+            }
+            
+            url = f"{self.base_url}/charges"
+            async with session.post(url, json=charge_data) as response:
+                if response.status in [200, 201]:
+                    data = orjson.loads(await response.read())
+                    charge = data.get("data", {})
+                    return CoinbasePayment(
+                        charge_id=charge.get("id"),
+                        amount=amount,
+                        currency=currency,
+                        status="pending",
+                        payment_url=charge.get("hosted_url")
+                    )
+                else:
+                    error = await response.text()
+                    logger.error(f"Coinbase charge creation failed: {error}")
+                    raise Exception(f"Failed to create charge: {error}")
+                    
+        except asyncio.TimeoutError:
+            logger.error("Coinbase charge creation timed out")
+            raise
         except Exception as e:
             logger.error(f"Coinbase integration error: {e}")
             raise
     
     async def get_charge_status(self, charge_id: str) -> Dict[str, Any]:
         """Check payment status"""
-        async with aiohttp.ClientSession() as session:
-            url = f"{self.base_url}/charges/{charge_id}"
-            async with session.get(url, headers=self.headers) as response:
+        session = await self._get_session()
+        url = f"{self.base_url}/charges/{charge_id}"
+        try:
+            async with session.get(url) as response:
                 if response.status == 200:
-                    data = await response.json()
+                    data = orjson.loads(await response.read())
                     charge = data.get("data", {})
                     return {
                         "status": charge.get("timeline", [{}])[-1].get("status", "pending"),
@@ -93,6 +138,9 @@ class CoinbaseCommerceClient:
                         "amount_received": self._calculate_received_amount(charge)
                     }
                 return {"status": "unknown", "error": await response.text()}
+        except asyncio.TimeoutError:
+            logger.error(f"Coinbase charge status timed out for {charge_id}")
+            return {"status": "unknown", "error": "timeout"}
     
     def _calculate_received_amount(self, charge: Dict) -> float:
         """Calculate total amount received in USD equivalent"""
@@ -105,22 +153,29 @@ class CoinbaseCommerceClient:
     
     def verify_webhook(self, payload: bytes, signature: str) -> bool:
         """Verify webhook signature from Coinbase"""
-        expected_signature = hmac.new(
-            self.webhook_secret.encode(),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
-        return hmac.compare_digest(expected_signature, signature)
+        if self._hmac_template is None:
+            logger.error("Coinbase webhook secret not configured")
+            return False
+        mac = self._hmac_template.copy()
+        mac.update(payload)
+        return hmac.compare_digest(mac.hexdigest(), signature)
 
 # Integration with EazyPay backend
 async def process_coinbase_payment(
     amount: float,
-    customer_name: str = "Jaison Jayaraj"
+    customer_name: str = "Jaison Jayaraj",
+    client: Optional[CoinbaseCommerceClient] = None
 ) -> Dict[str, Any]:
-    """Process payment through Coinbase Commerce"""
-    try:
+    """Process payment through Coinbase Commerce
+    
+    Pass a long-lived ``client`` to reuse its connection pool; otherwise a
+    temporary client is created and closed for this payment.
+    """
+    owns_client = client is None
+    if owns_client:
         client = CoinbaseCommerceClient()
-        
+    
+    try:
         # Create charge
         payment = await client.create_charge(
             amount=amount,
@@ -147,6 +202,9 @@ async def process_coinbase_payment(
             "provider": "Coinbase Commerce",
             "error": str(e)
         }
+    finally:
+        if owns_client:
+            await client.close()
 
 # Demo/test function
 async def test_coinbase_integration():
@@ -1,23 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import os
 import time
 import random
+import math
+import asyncio
+import uuid
+import orjson
+from collections import deque
 from typing import Optional, Dict, Any
-from dotenv import load_dotenv
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# Set DEMO_SIMULATE_DELAY=0 to skip the artificial processing delay (e.g. for load tests)
+SIMULATE_DELAY = os.getenv("DEMO_SIMULATE_DELAY", "1").strip().lower() not in ("0", "false", "no", "off")
 
 app = FastAPI(
     title="EazyPay Demo Backend",
     description="Demo-ready crypto tap-to-pay backend for hackathon",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -29,24 +36,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Balances are kept in integer cents so demo arithmetic stays exact
+def to_cents(amount: float) -> int:
+    """Convert a USD amount to integer cents"""
+    return int(round(amount * 100))
+
+def to_usd(cents: int) -> float:
+    """Convert integer cents back to a USD amount for responses"""
+    return cents / 100
+
+# Cap stored history so a long-running demo doesn't grow without bound
+MAX_DEMO_TRANSACTIONS = 1000
+# Latest transactions kept separately for the merchant's "recent settlements"
+RECENT_SETTLEMENTS = 5
+
 # Simulated customer data for demo
 DEMO_CUSTOMERS = {
     "alice": {
         "id": "3ed93e27-3a1d-4be7-b139-7ee34578c873",
         "name": "Jaison Jayaraj",
         "email": "jaison.freepay.demo@example.com",
-        "balance_usd": 1000.00,
-        "transactions": []
+        "balance_cents": 100000,
+        "transactions": deque(maxlen=MAX_DEMO_TRANSACTIONS),
+        "recent": deque(maxlen=RECENT_SETTLEMENTS)
     },
     "bob": {
         "id": "49eed76a-008d-49e7-9118-b497d86bfc74", 
         "name": "Bob's Coffee Shop",
         "email": "bob.freepay.demo@example.com",
-        "balance_usd": 50.00,
-        "transactions": []
+        "balance_cents": 5000,
+        "transactions": deque(maxlen=MAX_DEMO_TRANSACTIONS),
+        "recent": deque(maxlen=RECENT_SETTLEMENTS)
     }
 }
 
+# Running aggregates so the dashboard doesn't rescan every transaction
+DEMO_STATE = {
+    "total_volume_cents": 0
+}
+
+# Serialises balance mutations across concurrent payment requests
+BALANCE_LOCK = asyncio.Lock()
+
 class PaymentRequest(BaseModel):
     amount: float
     currency: str = "USD"
@@ -60,54 +91,61 @@ class PaymentResponse(BaseModel):
     fern_transfer_id: str
     message: str
 
+# Constant payloads are serialized once at import
+ROOT_BODY = orjson.dumps({
+    "service": "EazyPay Demo Backend",
+    "status": "running",
+    "version": "1.0.0",
+    "demo_mode": True
+})
+HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "EazyPay Demo Backend"})
+
 @app.get("/")
 async def root():
-    return {
-        "service": "EazyPay Demo Backend",
-        "status": "running",
-        "version": "1.0.0",
-        "demo_mode": True
-    }
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "EazyPay Demo Backend"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 @app.get("/customers/alice/balance")
 async def get_alice_balance():
     """Get Jaison's balance for demo"""
-    return {
+    return ORJSONResponse({
         "customer_id": DEMO_CUSTOMERS["alice"]["id"],
         "balances": {
-            "USD": DEMO_CUSTOMERS["alice"]["balance_usd"]
+            "USD": to_usd(DEMO_CUSTOMERS["alice"]["balance_cents"])
         },
         "status": "active"
-    }
+    })
 
 @app.get("/customers/bob/balance") 
 async def get_bob_balance():
     """Get Bob's balance for demo"""
-    return {
+    return ORJSONResponse({
         "customer_id": DEMO_CUSTOMERS["bob"]["id"],
         "balances": {
-            "USD": DEMO_CUSTOMERS["bob"]["balance_usd"]
+            "USD": to_usd(DEMO_CUSTOMERS["bob"]["balance_cents"])
         },
         "status": "active"
-    }
+    })
 
 @app.get("/merchant/balance")
 async def get_merchant_balance():
     """Get merchant's current balance"""
-    return {
-        "merchant_id": DEMO_CUSTOMERS["bob"]["id"],
+    bob = DEMO_CUSTOMERS["bob"]
+    return ORJSONResponse({
+        "merchant_id": bob["id"],
         "balances": {
-            "USD": DEMO_CUSTOMERS["bob"]["balance_usd"]
+            "USD": to_usd(bob["balance_cents"])
         },
-        "recent_settlements": DEMO_CUSTOMERS["bob"]["transactions"][-5:],
+        "recent_settlements": list(bob["recent"]),
         "status": "active"
-    }
+    })
 
-@app.post("/process-payment", response_model=PaymentResponse)
+# PaymentResponse is documented via `responses` rather than `response_model`
+# so the handler's dict is not validated and re-encoded on every payment
+@app.post("/process-payment", responses={200: {"model": PaymentResponse}})
 async def process_payment(payment: PaymentRequest):
     """
     Demo payment processing endpoint
@@ -124,52 +162,65 @@ async def process_payment(payment: PaymentRequest):
         # Simulate conversion (1:1 for demo)
         usd_amount = payment.amount
         
-        # Check Jaison has sufficient balance
-        if DEMO_CUSTOMERS["alice"]["balance_usd"] < payment.amount:
-            raise HTTPException(status_code=400, detail=f"Insufficient funds: Jaison has ${DEMO_CUSTOMERS['alice']['balance_usd']}, needs ${payment.amount}")
+        alice = DEMO_CUSTOMERS["alice"]
+        bob = DEMO_CUSTOMERS["bob"]
+        amount_cents = to_cents(payment.amount)
         
-        # Process the transfer
-        DEMO_CUSTOMERS["alice"]["balance_usd"] -= payment.amount
-        DEMO_CUSTOMERS["bob"]["balance_usd"] += payment.amount
-        
-        # Create transaction records
-        tx_id = f"demo_tx_{int(time.time())}_{random.randint(1000, 9999)}"
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        alice_tx = {
-            "id": tx_id,
-            "type": "payment_sent", 
-            "amount": -payment.amount,
-            "to": "Bob's Coffee Shop",
-            "timestamp": timestamp,
-            "crypto_tx": payment.crypto_tx_hash,
-            "chain": get_chain_name(payment.chain_id)
-        }
-        
-        bob_tx = {
-            "id": tx_id,
-            "type": "payment_received",
-            "amount": payment.amount, 
-            "from": "Jaison Jayaraj",
-            "timestamp": timestamp,
-            "settlement_status": "completed",
-            "crypto_tx": payment.crypto_tx_hash,
-            "chain": get_chain_name(payment.chain_id)
-        }
-        
-        DEMO_CUSTOMERS["alice"]["transactions"].append(alice_tx)
-        DEMO_CUSTOMERS["bob"]["transactions"].append(bob_tx)
+        # Balance check, debit/credit and records happen atomically
+        async with BALANCE_LOCK:
+            # Check Jaison has sufficient balance
+            if alice["balance_cents"] < amount_cents:
+                raise HTTPException(status_code=400, detail=f"Insufficient funds: Jaison has ${to_usd(alice['balance_cents'])}, needs ${payment.amount}")
+            
+            # Process the transfer
+            alice["balance_cents"] -= amount_cents
+            bob["balance_cents"] += amount_cents
+            
+            # Create transaction records
+            tx_id = f"demo_tx_{uuid.uuid4().hex[:12]}"
+            timestamp = format_timestamp(time.time())
+            chain_name = get_chain_name(payment.chain_id)
+            
+            alice_tx = {
+                "id": tx_id,
+                "type": "payment_sent", 
+                "amount": -payment.amount,
+                "to": "Bob's Coffee Shop",
+                "timestamp": timestamp,
+                "crypto_tx": payment.crypto_tx_hash,
+                "chain": chain_name
+            }
+            
+            bob_tx = {
+                "id": tx_id,
+                "type": "payment_received",
+                "amount": payment.amount, 
+                "from": "Jaison Jayaraj",
+                "timestamp": timestamp,
+                "settlement_status": "completed",
+                "crypto_tx": payment.crypto_tx_hash,
+                "chain": chain_name
+            }
+            
+            alice["transactions"].append(alice_tx)
+            alice["recent"].append(alice_tx)
+            bob["transactions"].append(bob_tx)
+            bob["recent"].append(bob_tx)
+            DEMO_STATE["total_volume_cents"] += amount_cents
+            
+            alice_balance = to_usd(alice["balance_cents"])
+            bob_balance = to_usd(bob["balance_cents"])
         
         logger.info(f"[DEMO] ✅ Payment successful: ${usd_amount} transferred to merchant")
-        logger.info(f"[DEMO] Jaison balance: ${DEMO_CUSTOMERS['alice']['balance_usd']}")
-        logger.info(f"[DEMO] Bob balance: ${DEMO_CUSTOMERS['bob']['balance_usd']}")
+        logger.info(f"[DEMO] Jaison balance: ${alice_balance}")
+        logger.info(f"[DEMO] Bob balance: ${bob_balance}")
         
-        return PaymentResponse(
-            success=True,
-            merchant_received_amount=usd_amount,
-            fern_transfer_id=tx_id,
-            message=f"Successfully processed ${usd_amount} crypto payment with instant fiat settlement"
-        )
+        return ORJSONResponse({
+            "success": True,
+            "merchant_received_amount": usd_amount,
+            "fern_transfer_id": tx_id,
+            "message": f"Successfully processed ${usd_amount} crypto payment with instant fiat settlement"
+        })
         
     except HTTPException:
         raise
@@ -180,121 +231,187 @@ async def process_payment(payment: PaymentRequest):
 @app.post("/demo/reset")
 async def reset_demo():
     """Reset demo balances for multiple demonstrations"""
-    DEMO_CUSTOMERS["alice"]["balance_usd"] = 1000.00
-    DEMO_CUSTOMERS["bob"]["balance_usd"] = 50.00
-    DEMO_CUSTOMERS["alice"]["transactions"].clear()
-    DEMO_CUSTOMERS["bob"]["transactions"].clear()
+    alice = DEMO_CUSTOMERS["alice"]
+    bob = DEMO_CUSTOMERS["bob"]
+    
+    async with BALANCE_LOCK:
+        alice["balance_cents"] = 100000
+        bob["balance_cents"] = 5000
+        alice["transactions"].clear()
+        alice["recent"].clear()
+        bob["transactions"].clear()
+        bob["recent"].clear()
+        DEMO_STATE["total_volume_cents"] = 0
     
     return {
         "message": "Demo reset successful",
-        "alice_balance": DEMO_CUSTOMERS["alice"]["balance_usd"],
-        "bob_balance": DEMO_CUSTOMERS["bob"]["balance_usd"]
+        "alice_balance": to_usd(alice["balance_cents"]),
+        "bob_balance": to_usd(bob["balance_cents"])
     }
 
 @app.get("/demo/status")
 async def demo_status():
     """Get current demo status for dashboard"""
-    return {
+    alice = DEMO_CUSTOMERS["alice"]
+    bob = DEMO_CUSTOMERS["bob"]
+    return ORJSONResponse({
         "customers": {
             "alice": {
-                "name": DEMO_CUSTOMERS["alice"]["name"],
-                "balance": DEMO_CUSTOMERS["alice"]["balance_usd"],
-                "transactions": len(DEMO_CUSTOMERS["alice"]["transactions"])
+                "name": alice["name"],
+                "balance": to_usd(alice["balance_cents"]),
+                "transactions": len(alice["transactions"])
             },
             "bob": {
-                "name": DEMO_CUSTOMERS["bob"]["name"],
-                "balance": DEMO_CUSTOMERS["bob"]["balance_usd"],
-                "transactions": len(DEMO_CUSTOMERS["bob"]["transactions"])
+                "name": bob["name"],
+                "balance": to_usd(bob["balance_cents"]),
+                "transactions": len(bob["transactions"])
             }
         },
-        "total_volume": sum(abs(tx["amount"]) for customer in DEMO_CUSTOMERS.values() for tx in customer["transactions"]),
+        "total_volume": to_usd(DEMO_STATE["total_volume_cents"]),
         "demo_ready": True
-    }
+    })
 
 async def simulate_processing_delay():
     """Simulate realistic payment processing time"""
-    import asyncio
+    if not SIMULATE_DELAY:
+        return
     # Simulate 0.5-1.5 second processing time
     delay = 0.5 + random.random()
     await asyncio.sleep(delay)
 
+# Last formatted timestamp, reused for payments within the same second
+_last_timestamp = {"second": -1, "text": ""}
+
+def format_timestamp(now: float) -> str:
+    """Format a display timestamp, reusing the cached string within the same second"""
+    second = int(now)
+    if second != _last_timestamp["second"]:
+        _last_timestamp["second"] = second
+        _last_timestamp["text"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+    return _last_timestamp["text"]
+
+CHAIN_NAMES = {
+    1: "Ethereum",
+    10: "Optimism", 
+    137: "Polygon",
+    42161: "Arbitrum",
+    8453: "Base",
+    84532: "Base Sepolia",
+    11155111: "Ethereum Sepolia"
+}
+
 def get_chain_name(chain_id: int) -> str:
     """Get human-readable chain name"""
-    chain_names = {
-        1: "Ethereum",
-        10: "Optimism", 
-        137: "Polygon",
-        42161: "Arbitrum",
-        8453: "Base",
-        84532: "Base Sepolia",
-        11155111: "Ethereum Sepolia"
-    }
-    return chain_names.get(chain_id, f"Chain {chain_id}")
+    name = CHAIN_NAMES.get(chain_id)
+    return name if name is not None else f"Chain {chain_id}"
+
+INTEGRATIONS_BODY = orjson.dumps({
+    "integrations": [
+        {
+            "name": "Fern API",
+            "status": "active",
+            "description": "Crypto-to-fiat instant settlement",
+            "features": ["KYC/AML", "Bank transfers", "Multi-currency"]
+        },
+        {
+            "name": "Coinbase Commerce",
+            "status": "ready",
+            "description": "Accept payments in multiple cryptocurrencies",
+            "features": ["BTC", "ETH", "USDC", "Instant conversion"]
+        },
+        {
+            "name": "Circle USDC",
+            "status": "ready",
+            "description": "Stablecoin infrastructure with programmable wallets",
+            "features": ["Multi-chain USDC", "Smart routing", "Low fees", "Instant settlement"]
+        },
+        {
+            "name": "Alchemy",
+            "status": "active",
+            "description": "Blockchain infrastructure and balance detection",
+            "features": ["Multi-chain support", "Real-time balances", "Transaction monitoring"]
+        }
+    ],
+    "optimal_flow": "Circle USDC on Base chain for lowest fees"
+})
 
 @app.get("/integrations")
 async def get_integrations():
     """Get available payment integrations"""
-    return {
-        "integrations": [
-            {
-                "name": "Fern API",
-                "status": "active",
-                "description": "Crypto-to-fiat instant settlement",
-                "features": ["KYC/AML", "Bank transfers", "Multi-currency"]
-            },
-            {
-                "name": "Coinbase Commerce",
-                "status": "ready",
-                "description": "Accept payments in multiple cryptocurrencies",
-                "features": ["BTC", "ETH", "USDC", "Instant conversion"]
-            },
-            {
-                "name": "Circle USDC",
-                "status": "ready",
-                "description": "Stablecoin infrastructure with programmable wallets",
-                "features": ["Multi-chain USDC", "Smart routing", "Low fees", "Instant settlement"]
-            },
-            {
-                "name": "Alchemy",
-                "status": "active",
-                "description": "Blockchain infrastructure and balance detection",
-                "features": ["Multi-chain support", "Real-time balances", "Transaction monitoring"]
-            }
-        ],
-        "optimal_flow": "Circle USDC on Base chain for lowest fees"
-    }
+    return Response(content=INTEGRATIONS_BODY, media_type="application/json")
+
+# Base, Polygon, Optimism, Arbitrum
+CIRCLE_CHAINS = frozenset({8453, 137, 10, 42161})
 
-@app.post("/process-payment-v2")
-async def process_payment_v2(payment: PaymentRequest):
-    """Enhanced payment processing with multiple provider options"""
+# Provider options are static, so both routing outcomes are built once
+CIRCLE_PROVIDER = {
+    "provider": "Circle USDC",
+    "fee": 0.05,
+    "speed": "2 seconds",
+    "selected": True
+}
+COINBASE_PROVIDER = {
+    "provider": "Coinbase Commerce",
+    "fee": 0.30,
+    "speed": "10 seconds",
+    "selected": False
+}
+PROVIDERS_WITH_CIRCLE = [CIRCLE_PROVIDER, COINBASE_PROVIDER]
+PROVIDERS_FALLBACK_ONLY = [COINBASE_PROVIDER]
+
+# The body is read by hand, so document its schema explicitly
+@app.post(
+    "/process-payment-v2",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": PaymentRequest.model_json_schema()}}
+        }
+    }
+)
+async def process_payment_v2(request: Request):
+    """Enhanced payment processing with multiple provider options
+    
+    Internal endpoint: the body comes from our own apps, so it is decoded with
+    orjson and loaded without Pydantic validation. /process-payment keeps full
+    validation for public callers.
+    """
     try:
-        # Simulate smart routing
-        providers = []
-        
-        # Check Circle USDC availability
-        if payment.chain_id in [8453, 137, 10, 42161]:  # Base, Polygon, Optimism, Arbitrum
-            providers.append({
-                "provider": "Circle USDC",
-                "fee": 0.05,
-                "speed": "2 seconds",
-                "selected": True
-            })
-        
-        # Coinbase Commerce as fallback
-        providers.append({
-            "provider": "Coinbase Commerce",
-            "fee": 0.30,
-            "speed": "10 seconds",
-            "selected": False
-        })
+        data = orjson.loads(await request.body())
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=400, detail="Invalid payment body: expected a JSON object")
+        payment = PaymentRequest.model_construct(**data)
+        # Without validation, missing or malformed fields only surface on access
+        chain_id = payment.chain_id
+        usd_amount = float(payment.amount)
+        if not math.isfinite(usd_amount):
+            raise HTTPException(status_code=400, detail="Invalid payment body: amount must be a finite number")
+        if not isinstance(chain_id, int) or isinstance(chain_id, bool):
+            raise HTTPException(status_code=400, detail="Invalid payment body: chain_id must be an integer")
+    except AttributeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payment body: missing {e.name}")
+    except (orjson.JSONDecodeError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payment body: {e}")
+    
+    try:
+        # Simulate smart routing (Circle USDC when the chain supports it,
+        # Coinbase Commerce as fallback)
+        if chain_id in CIRCLE_CHAINS:
+            providers = PROVIDERS_WITH_CIRCLE
+        else:
+            providers = PROVIDERS_FALLBACK_ONLY
         
         # Process through selected provider (Circle for demo)
         selected = providers[0] if providers else {"provider": "Fern API"}
         
         # Update balances
-        usd_amount = float(payment.amount)
-        DEMO_CUSTOMERS["alice"]["balance_usd"] -= usd_amount
-        DEMO_CUSTOMERS["bob"]["balance_usd"] += usd_amount
+        amount_cents = to_cents(usd_amount)
+        alice = DEMO_CUSTOMERS["alice"]
+        bob = DEMO_CUSTOMERS["bob"]
+        async with BALANCE_LOCK:
+            alice["balance_cents"] -= amount_cents
+            bob["balance_cents"] += amount_cents
+            DEMO_STATE["total_volume_cents"] += amount_cents
         
         return {
             "success": True,
@@ -312,6 +429,22 @@ async def process_payment_v2(payment: PaymentRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
+    import importlib
+    import sys
     import uvicorn
+    # Workers need an import string; make "app.demo_backend" importable when this
+    # file is run directly as `python app/demo_backend.py`. Importing the package
+    # also loads .env, which a script run otherwise skips.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    importlib.import_module("app")
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # Demo balances live in process memory, so a single worker is the default;
+    # uvicorn's "auto" loop/http pick uvloop/httptools from uvicorn[standard] when
+    # installed (uvloop isn't available on Windows, where run.bat is used)
+    uvicorn.run(
+        "app.demo_backend:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+        log_level="warning"
+    )
\ No newline at end of file
@@ -1,11 +1,11 @@
 import aiohttp
 import asyncio
 import os
-import json
+import orjson
 from typing import Dict, Any, Optional
-from dotenv import load_dotenv
+import logging
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 class FernClient:
     def __init__(self):
@@ -19,100 +19,115 @@ class FernClient:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        print(f"[KEY] Fern client initialized with API key: {self.api_key[:10]}...")
+        
+        # Shared HTTP session, created lazily so the connection pool is reused
+        self._session: Optional[aiohttp.ClientSession] = None
+        logger.info("Fern client initialized with API key: %s...", self.api_key[:10])
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                json_serialize=lambda obj: orjson.dumps(obj).decode(),
+                timeout=aiohttp.ClientTimeout(total=10, connect=3, sock_read=8)
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def __aenter__(self) -> "FernClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
     
     async def create_customer(self, name: str, email: str) -> Dict[str, Any]:
         """Create a new Fern customer"""
-        async with aiohttp.ClientSession() as session:
-            # Split name into first and last name
-            name_parts = name.split(' ', 1)
-            first_name = name_parts[0]
-            last_name = name_parts[1] if len(name_parts) > 1 else "Demo"
-            
-            payload = {
-                "firstName": first_name,
-                "lastName": last_name,
-                "email": email,
-                "customerType": "INDIVIDUAL"
-            }
-            
-            print(f"[CREATE] Creating customer: {name} ({email})")
-            async with session.post(
-                f"{self.base_url}/customers",
-                headers=self.headers,
-                json=payload
-            ) as response:
-                result = await response.json()
-                print(f"[RESPONSE] Customer creation response: {result}")
-                return result
+        session = await self._get_session()
+        # Split name into first and last name
+        name_parts = name.split(' ', 1)
+        first_name = name_parts[0]
+        last_name = name_parts[1] if len(name_parts) > 1 else "Demo"
+        
+        payload = {
+            "firstName": first_name,
+            "lastName": last_name,
+            "email": email,
+            "customerType": "INDIVIDUAL"
+        }
+        
+        logger.info("Creating customer: %s (%s)", name, email)
+        async with session.post(
+            f"{self.base_url}/customers",
+            json=payload
+        ) as response:
+            result = await response.json(loads=orjson.loads)
+            logger.debug("Customer creation response: %s", result)
+            return result
     
     async def get_customer(self, customer_id: str) -> Dict[str, Any]:
         """Get customer details"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/customers/{customer_id}",
-                headers=self.headers
-            ) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.get(f"{self.base_url}/customers/{customer_id}") as response:
+            return await response.json(loads=orjson.loads)
     
     async def customer_convert(self, customer_id: str, from_currency: str, 
                               to_currency: str, amount: float) -> Dict[str, Any]:
         """Convert currency for a customer"""
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "from": {"currency": from_currency, "amount": str(amount)},
-                "to": {"currency": to_currency}
-            }
-            
-            print(f"[CONVERT] Converting {amount} {from_currency} -> {to_currency} for customer {customer_id}")
-            async with session.post(
-                f"{self.base_url}/customers/{customer_id}/convert",
-                headers=self.headers,
-                json=payload
-            ) as response:
-                result = await response.json()
-                print(f"[CONVERT] Conversion result: {result}")
-                return result
+        session = await self._get_session()
+        payload = {
+            "from": {"currency": from_currency, "amount": str(amount)},
+            "to": {"currency": to_currency}
+        }
+        
+        logger.info("Converting %s %s -> %s for customer %s", amount, from_currency, to_currency, customer_id)
+        async with session.post(
+            f"{self.base_url}/customers/{customer_id}/convert",
+            json=payload
+        ) as response:
+            result = await response.json(loads=orjson.loads)
+            logger.debug("Conversion result: %s", result)
+            return result
     
     async def customer_transfer(self, from_customer: str, to_customer: str, 
                                amount: float, currency: str) -> Dict[str, Any]:
         """Transfer between customers"""
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "destination": {"customer_id": to_customer},
-                "amount": str(amount),
-                "currency": currency
-            }
-            
-            print(f"[TRANSFER] Transferring {amount} {currency} from {from_customer} to {to_customer}")
-            async with session.post(
-                f"{self.base_url}/customers/{from_customer}/transfers",
-                headers=self.headers,
-                json=payload
-            ) as response:
-                result = await response.json()
-                print(f"[TRANSFER] Transfer result: {result}")
-                return result
+        session = await self._get_session()
+        payload = {
+            "destination": {"customer_id": to_customer},
+            "amount": str(amount),
+            "currency": currency
+        }
+        
+        logger.info("Transferring %s %s from %s to %s", amount, currency, from_customer, to_customer)
+        async with session.post(
+            f"{self.base_url}/customers/{from_customer}/transfers",
+            json=payload
+        ) as response:
+            result = await response.json(loads=orjson.loads)
+            logger.debug("Transfer result: %s", result)
+            return result
     
     async def get_customer_balance(self, customer_id: str) -> Dict[str, Any]:
         """Get customer balance"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/customers/{customer_id}/accounts",
-                headers=self.headers
-            ) as response:
-                result = await response.json()
-                print(f"[BALANCE] Balance for {customer_id}: {result}")
-                return result
+        session = await self._get_session()
+        async with session.get(f"{self.base_url}/customers/{customer_id}/accounts") as response:
+            result = await response.json(loads=orjson.loads)
+            logger.debug("Balance for %s: %s", customer_id, result)
+            return result
     
     async def list_customer_transactions(self, customer_id: str) -> Dict[str, Any]:
         """List customer transactions"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/customers/{customer_id}/transactions",
-                headers=self.headers
-            ) as response:
-                return await response.json()
+        session = await self._get_session()
+        async with session.get(f"{self.base_url}/customers/{customer_id}/transactions") as response:
+            return await response.json(loads=orjson.loads)
 
 # Test function
 async def test_fern_connection():
@@ -133,4 +148,10 @@ async def test_fern_connection():
         return False
 
 if __name__ == "__main__":
+    import importlib
+    import sys
+    # Run directly as `python app/fern_client.py`, the app package (which loads .env)
+    # hasn't been imported yet
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    importlib.import_module("app")
     asyncio.run(test_fern_connection())
\ No newline at end of file
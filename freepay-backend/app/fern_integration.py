@@ -3,9 +3,11 @@ Real Fern API Integration for EazyPay
 Handles crypto-to-fiat conversion and bank settlement
 """
 import os
+import time
 import asyncio
 import aiohttp
-from typing import Dict, Any, Optional
+import orjson
+from typing import Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 import logging
 
@@ -30,30 +32,104 @@ class FernAPIClient:
         
         if not self.api_key:
             raise ValueError("FERN_API_KEY environment variable is required")
+        
+        # Shared HTTP session, created lazily so the connection pool is reused
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Index of the transfer endpoint that last succeeded, tried first next time
+        self._transfer_endpoint_index: Optional[int] = None
+        
+        # Verified customers stay verified, so their status is reused for a minute
+        self._status_ttl = 60.0
+        self._status_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._status_locks: Dict[str, asyncio.Lock] = {}
+        
+        # Last ETag and decoded body per URL, revalidated with If-None-Match
+        self._etag_cache: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def __aenter__(self) -> "FernAPIClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def _conditional_get(self, url: str) -> Tuple[int, Any]:
+        """GET a Fern resource, revalidating any cached copy with its ETag
+        
+        Returns the HTTP status and either the decoded body (200, or a 304
+        served from cache) or the error text.
+        """
+        session = await self._get_session()
+        cached = self._etag_cache.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else None
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached:
+                return 200, cached[1]
+            if response.status == 200:
+                body = await response.json(loads=orjson.loads)
+                etag = response.headers.get("ETag")
+                if etag:
+                    self._etag_cache[url] = (etag, body)
+                return 200, body
+            return response.status, await response.text()
+    
+    def _cached_status(self, customer_id: str) -> Optional[Dict[str, Any]]:
+        """Return a cached verified status for a customer if it is still fresh"""
+        cached = self._status_cache.get(customer_id)
+        if cached and time.monotonic() - cached[0] < self._status_ttl:
+            return cached[1]
+        return None
     
     async def get_customer_status(self, customer_id: str) -> Dict[str, Any]:
         """Check customer KYC and account status"""
-        async with aiohttp.ClientSession() as session:
+        status = self._cached_status(customer_id)
+        if status is not None:
+            return status
+        
+        # One fetch per customer at a time; concurrent callers reuse its result
+        lock = self._status_locks.setdefault(customer_id, asyncio.Lock())
+        async with lock:
+            status = self._cached_status(customer_id)
+            if status is not None:
+                return status
+            
             url = f"{self.base_url}/customers/{customer_id}"
-            async with session.get(url, headers=self.headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Fern API error: {response.status} - {error_text}")
-                    return {"error": f"HTTP {response.status}", "details": error_text}
+            http_status, body = await self._conditional_get(url)
+            if http_status == 200:
+                # Only verified customers are cached so KYC progress shows up immediately
+                if body.get("customerStatus") == "VERIFIED":
+                    self._status_cache[customer_id] = (time.monotonic(), body)
+                return body
+            else:
+                logger.error(f"Fern API error: {http_status} - {body}")
+                return {"error": f"HTTP {http_status}", "details": body}
     
     async def get_customer_wallets(self, customer_id: str) -> Dict[str, Any]:
         """Get customer's Fern wallet information"""
-        async with aiohttp.ClientSession() as session:
-            url = f"{self.base_url}/customers/{customer_id}/wallets"
-            async with session.get(url, headers=self.headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    error_text = await response.text()
-                    logger.warning(f"Wallets endpoint: {response.status} - {error_text}")
-                    return {"wallets": [], "error": f"HTTP {response.status}"}
+        url = f"{self.base_url}/customers/{customer_id}/wallets"
+        http_status, body = await self._conditional_get(url)
+        if http_status == 200:
+            return body
+        else:
+            logger.warning(f"Wallets endpoint: {http_status} - {body}")
+            return {"wallets": [], "error": f"HTTP {http_status}"}
     
     async def create_crypto_transfer(
         self, 
@@ -86,52 +162,62 @@ class FernAPIClient:
                 )
             
             # Try to create transfer (this endpoint needs to be discovered)
-            async with aiohttp.ClientSession() as session:
-                transfer_data = {
-                    "customerId": customer_id,
-                    "amount": amount,
-                    "currency": currency,
-                    "sourceType": "crypto",
-                    "metadata": {
-                        "crypto_tx_hash": crypto_tx_hash,
-                        "chain_id": chain_id,
-                        "payment_method": "EazyPay_NFC"
-                    }
+            session = await self._get_session()
+            transfer_data = {
+                "customerId": customer_id,
+                "amount": amount,
+                "currency": currency,
+                "sourceType": "crypto",
+                "metadata": {
+                    "crypto_tx_hash": crypto_tx_hash,
+                    "chain_id": chain_id,
+                    "payment_method": "EazyPay_NFC"
                 }
-                
-                # Try different possible endpoints
-                possible_endpoints = [
-                    f"{self.base_url}/transfers",
-                    f"{self.base_url}/payments",
-                    f"{self.base_url}/customers/{customer_id}/transfers"
-                ]
-                
-                for endpoint in possible_endpoints:
-                    try:
-                        async with session.post(endpoint, headers=self.headers, json=transfer_data) as response:
-                            response_text = await response.text()
-                            logger.info(f"Tried {endpoint}: {response.status} - {response_text}")
-                            
-                            if response.status in [200, 201]:
-                                result = await response.json()
-                                return FernPaymentResult(
-                                    success=True,
-                                    transfer_id=result.get("transferId", "fern_transfer_success"),
-                                    amount_received=amount,
-                                    settlement_status="completed"
-                                )
-                    except Exception as e:
-                        logger.warning(f"Endpoint {endpoint} failed: {e}")
-                        continue
-                
-                # If all endpoints fail, return error with details
-                return FernPaymentResult(
-                    success=False,
-                    transfer_id=None,
-                    amount_received=0.0,
-                    error_message="No valid Fern transfer endpoint found. May need API access or different integration approach."
-                )
-                
+            }
+            
+            # Try different possible endpoints
+            possible_endpoints = [
+                f"{self.base_url}/transfers",
+                f"{self.base_url}/payments",
+                f"{self.base_url}/customers/{customer_id}/transfers"
+            ]
+            
+            # Probe one at a time: these are money-moving POSTs, so firing them
+            # concurrently could create duplicate transfers. Starting with the
+            # endpoint that worked last time avoids the failed round-trips instead.
+            order = list(range(len(possible_endpoints)))
+            if self._transfer_endpoint_index is not None:
+                order.remove(self._transfer_endpoint_index)
+                order.insert(0, self._transfer_endpoint_index)
+            
+            for index in order:
+                endpoint = possible_endpoints[index]
+                try:
+                    async with session.post(endpoint, json=transfer_data) as response:
+                        response_text = await response.text()
+                        logger.info(f"Tried {endpoint}: {response.status} - {response_text}")
+                        
+                        if response.status in [200, 201]:
+                            self._transfer_endpoint_index = index
+                            result = await response.json(loads=orjson.loads)
+                            return FernPaymentResult(
+                                success=True,
+                                transfer_id=result.get("transferId", "fern_transfer_success"),
+                                amount_received=amount,
+                                settlement_status="completed"
+                            )
+                except Exception as e:
+                    logger.warning(f"Endpoint {endpoint} failed: {e}")
+                    continue
+            
+            # If all endpoints fail, return error with details
+            return FernPaymentResult(
+                success=False,
+                transfer_id=None,
+                amount_received=0.0,
+                error_message="No valid Fern transfer endpoint found. May need API access or different integration approach."
+            )
+            
         except Exception as e:
             logger.error(f"Fern transfer error: {e}")
             return FernPaymentResult(
@@ -152,16 +238,14 @@ async def test_fern_integration():
     
     print("=== Testing Fern API Integration ===")
     
-    # Check Jaison's status
-    alice_status = await client.get_customer_status(alice_id)
+    # Check both statuses and Jaison's wallets concurrently
+    alice_status, bob_status, alice_wallets = await asyncio.gather(
+        client.get_customer_status(alice_id),
+        client.get_customer_status(bob_id),
+        client.get_customer_wallets(alice_id)
+    )
     print(f"Jaison Status: {alice_status}")
-    
-    # Check Bob's status
-    bob_status = await client.get_customer_status(bob_id)
     print(f"Bob Status: {bob_status}")
-    
-    # Try to get wallets
-    alice_wallets = await client.get_customer_wallets(alice_id)
     print(f"Jaison Wallets: {alice_wallets}")
     
     # Test payment processing
@@ -172,6 +256,8 @@ async def test_fern_integration():
         chain_id=8453
     )
     print(f"Payment Result: {payment_result}")
+    
+    await client.close()
 
 if __name__ == "__main__":
     asyncio.run(test_fern_integration())
\ No newline at end of file
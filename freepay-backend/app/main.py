@@ -1,38 +1,98 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ValidationError
 from .fern_client import FernClient
+import aiohttp
+import asyncio
 import os
-from typing import Optional
-from dotenv import load_dotenv
+import orjson
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from decimal import Decimal
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (the app package has already loaded .env, see app/__init__.py)
+# LOG_LEVEL=WARNING in production skips the per-payment INFO records entirely
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# Read once at import; the values don't change while the server is running
+CUSTOMER_A_ID = os.getenv("CUSTOMER_A_ID")  # Payer
+CUSTOMER_B_ID = os.getenv("CUSTOMER_B_ID")  # Merchant
+PORT = int(os.getenv("PORT", 8000))
 
 app = FastAPI(
     title="FreePay Backend",
     description="Crypto tap-to-pay with instant fiat settlement",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Compress larger Fern customer/balance payloads; small payment responses are left alone
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Add CORS middleware
+# Only browser frontends need this; the Android apps aren't subject to CORS
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "https://freepay.app,https://admin.freepay.app").split(",")
+    if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
 # Initialize Fern client
 fern = FernClient()
 
+@app.on_event("startup")
+async def open_fern_session():
+    """Open the shared Fern connection pool before serving requests"""
+    await fern._get_session()
+
+@app.on_event("startup")
+async def check_customer_ids():
+    """Warn once at startup instead of on every request"""
+    # Not fatal: the README starts the server before setup_test_customers.py runs
+    if not CUSTOMER_A_ID or not CUSTOMER_B_ID:
+        logger.warning("CUSTOMER_A_ID/CUSTOMER_B_ID not configured; run setup_test_customers.py")
+
+@app.on_event("shutdown")
+async def close_fern_session():
+    await fern.close()
+
+# Registered for the concrete Fern failure types rather than Exception, so they are
+# handled inside CORSMiddleware and browser frontends can still read the 500 body.
+# ValueError covers a malformed Fern response body (orjson.JSONDecodeError).
+@app.exception_handler(aiohttp.ClientError)
+@app.exception_handler(asyncio.TimeoutError)
+@app.exception_handler(ValueError)
+async def fern_error(request: Request, exc: Exception):
+    """Log a failed Fern call and report it as a 500"""
+    logger.error("Fern request failed for %s %s: %r", request.method, request.url.path, exc)
+    return ORJSONResponse({"detail": str(exc) or type(exc).__name__}, status_code=500)
+
+def to_cents(amount) -> int:
+    """Convert a decimal USD amount (number or string) to integer cents"""
+    return int(Decimal(str(amount)) * 100)
+
+def to_usd(cents: int) -> Decimal:
+    """Convert integer cents to an exact USD amount for the Fern API"""
+    return Decimal(cents).scaleb(-2)
+
+# Money is carried as integer cents; Fern only sees decimal USD amounts
 class PaymentRequest(BaseModel):
-    amount: float
+    amount_cents: int
     currency: str = "USD"
     crypto_tx_hash: str
     chain_id: int
@@ -40,7 +100,7 @@ class PaymentRequest(BaseModel):
 
 class PaymentResponse(BaseModel):
     success: bool
-    merchant_received_amount: float
+    merchant_received_amount: int
     fern_transfer_id: str
     message: str
 
@@ -48,64 +108,128 @@ class CustomerCreateRequest(BaseModel):
     name: str
     email: str
 
+# Constant bodies are serialized once; load balancers probe these constantly
+ROOT_BODY = orjson.dumps({
+    "service": "FreePay Backend",
+    "status": "running",
+    "version": "1.0.0"
+})
+HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "FreePay Backend"})
+
 @app.get("/")
 async def root():
-    return {
-        "service": "FreePay Backend",
-        "status": "running",
-        "version": "1.0.0"
-    }
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "FreePay Backend"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 @app.post("/customers")
 async def create_customer(request: CustomerCreateRequest):
     """Create a new Fern customer for testing"""
-    try:
-        result = await fern.create_customer(request.name, request.email)
-        return result
-    except Exception as e:
-        logger.error(f"Error creating customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await fern.create_customer(request.name, request.email)
+    return result
 
 @app.get("/customers/{customer_id}")
 async def get_customer(customer_id: str):
     """Get customer details"""
-    try:
-        result = await fern.get_customer(customer_id)
-        return result
-    except Exception as e:
-        logger.error(f"Error getting customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await fern.get_customer(customer_id)
+    return result
 
 @app.get("/customers/{customer_id}/balance")
 async def get_customer_balance(customer_id: str):
     """Get customer balance"""
+    result = await fern.get_customer_balance(customer_id)
+    return result
+
+# Dashboards poll this, so concurrent reads share one Fern call and a short-lived result
+MERCHANT_BALANCE_TTL = 2.0
+_merchant_balance: Optional[Tuple[float, Dict[str, Any]]] = None
+_merchant_balance_inflight: Optional["asyncio.Future[Dict[str, Any]]"] = None
+# Bumped on invalidation so a fetch that started before a payment can't cache its result
+_merchant_balance_generation = 0
+
+def _invalidate_merchant_balance():
+    """Drop the cached balance and detach any fetch that is already in flight"""
+    global _merchant_balance, _merchant_balance_inflight, _merchant_balance_generation
+    _merchant_balance = None
+    _merchant_balance_inflight = None
+    _merchant_balance_generation += 1
+
+async def _fetch_merchant_balance() -> Dict[str, Any]:
+    """Fetch the merchant balance, coalescing concurrent callers into one request"""
+    global _merchant_balance, _merchant_balance_inflight
+    
+    if _merchant_balance and time.monotonic() - _merchant_balance[0] < MERCHANT_BALANCE_TTL:
+        return _merchant_balance[1]
+    if _merchant_balance_inflight is not None:
+        return await asyncio.shield(_merchant_balance_inflight)
+    
+    future = asyncio.get_running_loop().create_future()
+    _merchant_balance_inflight = future
+    generation = _merchant_balance_generation
     try:
-        result = await fern.get_customer_balance(customer_id)
-        return result
+        balance = await fern.get_customer_balance(CUSTOMER_B_ID)
     except Exception as e:
-        logger.error(f"Error getting balance: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        future.set_exception(e)
+        future.exception()  # Mark retrieved so an unawaited failure isn't logged again
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    else:
+        if generation == _merchant_balance_generation:
+            _merchant_balance = (time.monotonic(), balance)
+        future.set_result(balance)
+    finally:
+        if _merchant_balance_inflight is future:
+            _merchant_balance_inflight = None
+    return balance
 
 @app.get("/merchant/balance")
 async def get_merchant_balance():
     """Get merchant's current balance"""
-    try:
-        customer_b_id = os.getenv("CUSTOMER_B_ID")
-        if not customer_b_id:
-            raise HTTPException(status_code=500, detail="Merchant customer ID not configured")
-        
-        balance = await fern.get_customer_balance(customer_b_id)
-        return balance
-    except Exception as e:
-        logger.error(f"Error getting merchant balance: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if not CUSTOMER_B_ID:
+        raise HTTPException(status_code=500, detail="Merchant customer ID not configured")
+    
+    balance = await _fetch_merchant_balance()
+    return balance
+
+# Clients retry on flaky connectivity, so settled payments are remembered by
+# (crypto_tx_hash, chain_id) and a retry gets the original result back
+PAYMENT_DEDUPE_TTL = 600
+PAYMENT_DEDUPE_MAX = 10_000
+_settled_payments: "OrderedDict[Tuple[str, int], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_inflight_payments: Dict[Tuple[str, int], "asyncio.Future[Dict[str, Any]]"] = {}
+
+def _cached_payment(key: Tuple[str, int]) -> Optional[Dict[str, Any]]:
+    """Return the result of an already settled payment if it is still fresh"""
+    cached = _settled_payments.get(key)
+    if cached and time.monotonic() - cached[0] < PAYMENT_DEDUPE_TTL:
+        return cached[1]
+    return None
+
+def _remember_payment(key: Tuple[str, int], body: Dict[str, Any]):
+    """Store a settled payment, evicting the oldest entries past the cap"""
+    _settled_payments[key] = (time.monotonic(), body)
+    _settled_payments.move_to_end(key)
+    while len(_settled_payments) > PAYMENT_DEDUPE_MAX:
+        _settled_payments.popitem(last=False)
 
-@app.post("/process-payment", response_model=PaymentResponse)
-async def process_payment(payment: PaymentRequest):
+# PaymentResponse only documents the schema; the handler builds the body itself so
+# FastAPI skips validating and re-serializing it. The request body is likewise
+# parsed and validated straight from bytes in one pydantic-core pass.
+@app.post(
+    "/process-payment",
+    responses={200: {"model": PaymentResponse}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": PaymentRequest.model_json_schema()}}
+        }
+    }
+)
+async def process_payment(request: Request):
     """
     Main payment processing endpoint
     1. Verify crypto transaction (simplified for demo)
@@ -113,14 +237,54 @@ async def process_payment(payment: PaymentRequest):
     3. Transfer USD to merchant customer
     """
     try:
-        customer_a_id = os.getenv("CUSTOMER_A_ID")  # Payer
-        customer_b_id = os.getenv("CUSTOMER_B_ID")  # Merchant
-        
-        if not customer_a_id or not customer_b_id:
+        payment = PaymentRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Same 422 shape FastAPI produces for a declared body parameter
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+    
+    key = (payment.crypto_tx_hash, payment.chain_id)
+    
+    body = _cached_payment(key)
+    if body is not None:
+        logger.info("Duplicate payment for TX %s on chain %s, returning original result", *key)
+        return ORJSONResponse(body)
+    
+    # A retry that arrives while the original is still settling waits for it
+    inflight = _inflight_payments.get(key)
+    if inflight is not None:
+        return ORJSONResponse(await asyncio.shield(inflight))
+    
+    future = asyncio.get_running_loop().create_future()
+    _inflight_payments[key] = future
+    try:
+        body = await _settle_payment(payment)
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved so an unawaited failure isn't logged again
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    else:
+        _remember_payment(key, body)
+        future.set_result(body)
+        # The merchant was just paid, so don't serve the pre-payment balance
+        _invalidate_merchant_balance()
+    finally:
+        _inflight_payments.pop(key, None)
+    
+    return ORJSONResponse(body)
+
+async def _settle_payment(payment: PaymentRequest) -> Dict[str, Any]:
+    """Convert the payer's crypto and transfer the USD to the merchant"""
+    try:
+        if not CUSTOMER_A_ID or not CUSTOMER_B_ID:
             raise HTTPException(status_code=500, detail="Customer IDs not configured")
         
-        logger.info(f"Processing payment: {payment.amount} {payment.currency}")
-        logger.info(f"Crypto TX: {payment.crypto_tx_hash} on chain {payment.chain_id}")
+        logger.info("Processing payment: %s cents %s", payment.amount_cents, payment.currency)
+        logger.info("Crypto TX: %s on chain %s", payment.crypto_tx_hash, payment.chain_id)
         
         # Step 1: Verify crypto transaction received
         # (In production, verify on-chain transaction)
@@ -129,10 +293,10 @@ async def process_payment(payment: PaymentRequest):
         # Step 2: Convert crypto to USD (simulate receiving crypto)
         # Note: In real implementation, you'd first receive the crypto, then convert
         conversion_result = await fern.customer_convert(
-            customer_id=customer_a_id,
+            customer_id=CUSTOMER_A_ID,
             from_currency="USDC",  # Assume USDC for demo
             to_currency="USD",
-            amount=payment.amount
+            amount=to_usd(payment.amount_cents)
         )
         
         # Check if conversion was successful
@@ -141,15 +305,15 @@ async def process_payment(payment: PaymentRequest):
             raise HTTPException(status_code=400, detail=f"Currency conversion failed: {error_msg}")
         
         # Extract converted amount (adjust based on actual Fern API response format)
-        usd_amount = payment.amount  # For demo, assume 1:1 conversion
+        usd_cents = payment.amount_cents  # For demo, assume 1:1 conversion
         if "amount" in conversion_result:
-            usd_amount = float(conversion_result["amount"])
+            usd_cents = to_cents(conversion_result["amount"])
         
         # Step 3: Transfer USD to merchant
         transfer_result = await fern.customer_transfer(
-            from_customer=customer_a_id,
-            to_customer=customer_b_id,
-            amount=usd_amount,
+            from_customer=CUSTOMER_A_ID,
+            to_customer=CUSTOMER_B_ID,
+            amount=to_usd(usd_cents),
             currency="USD"
         )
         
@@ -160,45 +324,51 @@ async def process_payment(payment: PaymentRequest):
         
         transfer_id = transfer_result.get("id", "unknown")
         
-        logger.info(f"✅ Payment successful: ${usd_amount} transferred to merchant")
+        logger.info("✅ Payment successful: $%s transferred to merchant", to_usd(usd_cents))
         
-        return PaymentResponse(
-            success=True,
-            merchant_received_amount=usd_amount,
-            fern_transfer_id=transfer_id,
-            message=f"Successfully transferred ${usd_amount} to merchant"
-        )
+        return {
+            "success": True,
+            "merchant_received_amount": usd_cents,
+            "fern_transfer_id": transfer_id,
+            "message": f"Successfully transferred ${to_usd(usd_cents)} to merchant"
+        }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Payment processing error: {e}")
+        logger.error("Payment processing error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/test-transfer")
 async def test_transfer(amount: float = 10.0):
     """Test transfer between customers"""
-    try:
-        customer_a_id = os.getenv("CUSTOMER_A_ID")
-        customer_b_id = os.getenv("CUSTOMER_B_ID")
-        
-        if not customer_a_id or not customer_b_id:
-            raise HTTPException(status_code=500, detail="Customer IDs not configured")
-        
-        result = await fern.customer_transfer(
-            from_customer=customer_a_id,
-            to_customer=customer_b_id,
-            amount=amount,
-            currency="USD"
-        )
-        
-        return {"message": f"Test transfer of ${amount} completed", "result": result}
-        
-    except Exception as e:
-        logger.error(f"Test transfer error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if not CUSTOMER_A_ID or not CUSTOMER_B_ID:
+        raise HTTPException(status_code=500, detail="Customer IDs not configured")
+    
+    result = await fern.customer_transfer(
+        from_customer=CUSTOMER_A_ID,
+        to_customer=CUSTOMER_B_ID,
+        amount=amount,
+        currency="USD"
+    )
+    
+    return {"message": f"Test transfer of ${amount} completed", "result": result}
 
 if __name__ == "__main__":
     import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # Each worker imports this module and opens its own Fern session at startup.
+    # Payment dedupe is per process, so a single worker stays the default;
+    # uvicorn's "auto" loop/http pick uvloop/httptools from uvicorn[standard] when
+    # installed; uvloop isn't available on Windows (run with `python -m app.main`)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=PORT,
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+        access_log=False,
+        log_level="warning",
+        # POS clients reuse connections across transactions; asyncio/uvloop
+        # already set TCP_NODELAY on accepted sockets
+        timeout_keep_alive=30,
+        backlog=4096
+    )
@@ -5,42 +5,77 @@ Run this once to create Jaison (payer) and Bob (merchant) customers
 """
 
 import asyncio
+import logging
 import os
-from dotenv import load_dotenv
+import re
+from typing import Optional
+# Importing the app package loads .env (see app/__init__.py)
 from app.fern_client import FernClient
 
-load_dotenv()
+# FernClient reports progress through logging rather than print
+logging.basicConfig(level=logging.INFO)
+
+CUSTOMER_ID_PATTERN = re.compile(r"^(CUSTOMER_[AB]_ID)=.*$", re.M)
+
+def update_env_file(env_file: str, values: dict):
+    """Write customer IDs into the .env file (blocking; run off the event loop)"""
+    with open(env_file, "r") as f:
+        content = f.read()
+    
+    # Replace both customer ID lines in one pass, then add any that are missing
+    content = CUSTOMER_ID_PATTERN.sub(lambda m: f"{m.group(1)}={values[m.group(1)]}", content)
+    for key, value in values.items():
+        if not re.search(rf"^{key}=", content, re.M):
+            content += f"\n{key}={value}"
+    
+    # Write to a temp file and rename so an interrupted write can't truncate .env
+    tmp_file = env_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(content)
+    os.replace(tmp_file, env_file)
+
+def report_customer(name: str, result) -> Optional[str]:
+    """Print the outcome of one create_customer call and return the new ID, if any"""
+    if isinstance(result, Exception):
+        print(f"[ERROR] {name} was not created: {result}")
+        return None
+    
+    customer_id = None
+    if result:
+        customer_id = result.get("customerId") or result.get("id") or result.get("customer_id")
+    if customer_id:
+        print(f"[SUCCESS] {name} created with ID: {customer_id}")
+    else:
+        print(f"[ERROR] {name} was not created. Fern response: {result}")
+    return customer_id
 
 async def setup_customers():
     """Create test customers for the demo"""
+    fern = None
     try:
         fern = FernClient()
         
         print("[SETUP] Setting up FreePay demo customers...")
         
-        # Create Customer A (Jaison - the payer)
+        # Create Customer A (Jaison - the payer) and Customer B (Bob - the merchant)
         print("\n[JAISON] Creating Jaison (Customer/Payer)...")
-        alice_result = await fern.create_customer(
-            name="Jaison Jayaraj",
-            email="jaison.freepay.demo@example.com"
+        print("[BOB] Creating Bob (Merchant/Receiver)...")
+        alice_result, bob_result = await asyncio.gather(
+            fern.create_customer(
+                name="Jaison Jayaraj",
+                email="jaison.freepay.demo@example.com"
+            ),
+            fern.create_customer(
+                name="Bob's Coffee Shop",
+                email="bob.freepay.demo@example.com"
+            ),
+            # One failure must not abandon the other creation mid-flight
+            return_exceptions=True
         )
         
-        alice_id = None
-        if alice_result:
-            alice_id = alice_result.get("customerId") or alice_result.get("id") or alice_result.get("customer_id")
-            print(f"[SUCCESS] Jaison created with ID: {alice_id}")
-        
-        # Create Customer B (Bob - the merchant)
-        print("\n[BOB] Creating Bob (Merchant/Receiver)...")
-        bob_result = await fern.create_customer(
-            name="Bob's Coffee Shop",
-            email="bob.freepay.demo@example.com"
-        )
-        
-        bob_id = None
-        if bob_result:
-            bob_id = bob_result.get("customerId") or bob_result.get("id") or bob_result.get("customer_id")
-            print(f"[SUCCESS] Bob created with ID: {bob_id}")
+        print()
+        alice_id = report_customer("Jaison", alice_result)
+        bob_id = report_customer("Bob", bob_result)
         
         # Update .env file with customer IDs
         if alice_id and bob_id:
@@ -50,23 +85,9 @@ async def setup_customers():
             
             # Try to update .env automatically
             try:
-                env_file = ".env"
-                with open(env_file, "r") as f:
-                    content = f.read()
-                
-                # Replace or add customer IDs
-                if "CUSTOMER_A_ID=" in content:
-                    content = content.replace(f"CUSTOMER_A_ID=customer_alice_id_here", f"CUSTOMER_A_ID={alice_id}")
-                else:
-                    content += f"\nCUSTOMER_A_ID={alice_id}"
-                
-                if "CUSTOMER_B_ID=" in content:
-                    content = content.replace(f"CUSTOMER_B_ID=customer_bob_id_here", f"CUSTOMER_B_ID={bob_id}")
-                else:
-                    content += f"\nCUSTOMER_B_ID={bob_id}"
-                
-                with open(env_file, "w") as f:
-                    f.write(content)
+                await asyncio.to_thread(
+                    update_env_file, ".env", {"CUSTOMER_A_ID": alice_id, "CUSTOMER_B_ID": bob_id}
+                )
                 
                 print(f"[SUCCESS] .env file updated automatically!")
                 
@@ -74,11 +95,13 @@ async def setup_customers():
                 print(f"[WARNING] Could not update .env automatically: {e}")
                 print("Please update manually.")
         
-        print("\n[COMPLETE] Customer setup complete!")
-        print("\nNext steps:")
-        print("1. Restart your backend server")
-        print("2. Test the /health endpoint")
-        print("3. Test a payment flow")
+            print("\n[COMPLETE] Customer setup complete!")
+            print("\nNext steps:")
+            print("1. Restart your backend server")
+            print("2. Test the /health endpoint")
+            print("3. Test a payment flow")
+        else:
+            print("\n[INCOMPLETE] Customer setup did not finish; fix the errors above and re-run")
         
     except Exception as e:
         print(f"[ERROR] Error setting up customers: {e}")
@@ -86,6 +109,10 @@ async def setup_customers():
         print("1. Check your Fern API key is correct")
         print("2. Verify you have internet connection")
         print("3. Check if you need to verify your Fern account")
+    
+    finally:
+        if fern is not None:
+            await fern.close()
 
 if __name__ == "__main__":
     asyncio.run(setup_customers())
\ No newline at end of file